@@ -1,25 +1,16 @@
 import sys
-import json
+import orjson
 import argparse
 import subprocess
-from sgfmill import sgf, boards
-
-def coords_to_gtp(row, col, size):
-    col_letter = chr(ord('A') + col + (1 if col >= 8 else 0))  # skip I
-    row_number = size - row
-    return f"{col_letter}{row_number}"
-
-def board_to_array(board):
-    size = board.side
-    return [
-        [
-            "empty" if (s := board.get(r, c)) is None else ("black" if s == "b" else "white")
-            for c in range(size)
-        ]
-        for r in range(size)
-    ]
-
-def sgf_to_katago_requests(sgf_path, move_indices):
+import threading
+from sgfmill import sgf
+
+KATAGO_COLUMNS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+# GTP coordinate for every sgfmill (row, col). sgfmill counts rows from the
+# bottom edge, so row 0 is GTP row 1.
+COORD = [[f"{KATAGO_COLUMNS[c]}{r + 1}" for c in range(25)] for r in range(25)]
+
+def sgf_to_katago_requests(sgf_path, move_indices, include_ownership=False, include_policy=False, include_pv=False):
     with open(sgf_path, 'rb') as f:
         game = sgf.Sgf_game.from_bytes(f.read())
 
@@ -31,37 +22,45 @@ def sgf_to_katago_requests(sgf_path, move_indices):
     komi_str = root.get('KM')
     komi = float(komi_str) if komi_str is not None else 6.5
 
-    sequence = game.get_main_sequence()
-    move_infos = [(i, *node.get_move()) for i, node in enumerate(sequence)]
-
-    requests = []
-    for move_num in move_indices:
-        temp_board = boards.Board(board_size)
-        moves = []
-        for i, color, move in move_infos[:move_num+1]:
-            if move:
-                row, col = move
-                temp_board.play(row, col, color)
-                moves.append([color.upper(), coords_to_gtp(row, col, board_size)])
-        player_to_move = "B" if len(moves) % 2 == 0 else "W"
-
-        req = {
-            "id": f"move_{move_num}",
-            "action": "analyze",
-            "rules": rules,
-            "komi": komi,
-            "boardXSize": board_size,
-            "boardYSize": board_size,
-            "board": board_to_array(temp_board),
-            "moves": moves,
-            "playerToMove": player_to_move,
-            "includePolicy": True,
-            "includeOwnership": True,
-            "includePV": True,
-            "maxVisits": 100
-        }
-        requests.append(req)
-    return requests
+    # KataGo rebuilds the position from initialStones + moves, so there is
+    # no need to replay the game on a board of our own.
+    black_stones, white_stones, _ = root.get_setup_stones()
+    initial_stones = [["B", COORD[row][col]] for row, col in black_stones]
+    initial_stones += [["W", COORD[row][col]] for row, col in white_stones]
+
+    # Send the whole game as a single query and let KataGo analyze every
+    # requested turn of it, rather than one query per checkpoint.
+    moves = []
+    turn_at_node = []
+    for node in game.get_main_sequence():
+        color, move = node.get_move()
+        if move:
+            row, col = move
+            moves.append([color.upper(), COORD[row][col]])
+        turn_at_node.append(len(moves))
+    analyze_turns = sorted({turn_at_node[min(i, len(turn_at_node) - 1)] for i in move_indices})
+
+    request = {
+        "id": "game",
+        "action": "analyze",
+        "rules": rules,
+        "komi": komi,
+        "boardXSize": board_size,
+        "boardYSize": board_size,
+        "initialStones": initial_stones,
+        "moves": moves,
+        "analyzeTurns": analyze_turns,
+        "maxVisits": 100
+    }
+    # Ownership and policy each add a few hundred floats to every response,
+    # so only ask for them when the caller wants them.
+    if include_ownership:
+        request["includeOwnership"] = True
+    if include_policy:
+        request["includePolicy"] = True
+    if include_pv:
+        request["includePV"] = True
+    return [request]
 
 def run_katago(requests, outfile_path=None):
     proc = subprocess.Popen(
@@ -69,16 +68,34 @@ def run_katago(requests, outfile_path=None):
         stdin=subprocess.PIPE,
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
-        text=True,
-        bufsize=1,
     )
 
-    out_file = open(outfile_path, "w") if outfile_path else None
+    out_file = open(outfile_path, "wb") if outfile_path else None
+
+    def _writer():
+        # Feed requests from a separate thread so KataGo's stdout is drained
+        # while we write; closing stdin lets KataGo finish and exit.
+        try:
+            for request in requests:
+                proc.stdin.write(orjson.dumps(request) + b"\n")
+                proc.stdin.flush()
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def _drain_stderr():
+        # KataGo logs to stderr; if nobody reads it the pipe fills up and
+        # KataGo blocks mid-search.
+        for _ in iter(proc.stderr.readline, b''):
+            pass
 
-    for request in requests:
-        json.dump(request, proc.stdin)
-        proc.stdin.write("\n")
-        proc.stdin.flush()
+    writer = threading.Thread(target=_writer, daemon=True)
+    writer.start()
+    threading.Thread(target=_drain_stderr, daemon=True).start()
 
     try:
         while True:
@@ -88,13 +105,12 @@ def run_katago(requests, outfile_path=None):
             if out_file:
                 out_file.write(line)
             else:
-                print("KataGo:", line.strip())
+                print("KataGo:", line.decode().strip())
     except KeyboardInterrupt:
         print("Interrupted.")
     finally:
         if out_file:
             out_file.close()
-        proc.stdin.close()
         proc.terminate()
         proc.wait()
 
@@ -103,7 +119,10 @@ if __name__ == "__main__":
     parser.add_argument("sgf_path", help="Path to .sgf file")
     parser.add_argument("--moves", nargs="+", type=int, required=True, help="List of move numbers to analyze (0-based)")
     parser.add_argument("--out", help="Output .txt file to save KataGo responses", default=None)
+    parser.add_argument("--with-ownership", action="store_true", help="Include KataGo's ownership map in each response")
+    parser.add_argument("--with-policy", action="store_true", help="Include KataGo's policy in each response")
+    parser.add_argument("--with-pv", action="store_true", help="Include the principal variation in each response")
     args = parser.parse_args()
 
-    requests = sgf_to_katago_requests(args.sgf_path, args.moves)
+    requests = sgf_to_katago_requests(args.sgf_path, args.moves, args.with_ownership, args.with_policy, args.with_pv)
     run_katago(requests, args.out)
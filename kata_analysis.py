@@ -1,5 +1,5 @@
 import subprocess
-import json
+import orjson
 
 # Start KataGo
 # Use a raw string (r"...") or double backslashes (".\katago") to fix the SyntaxWarning
@@ -7,9 +7,7 @@ katago = subprocess.Popen(
     [r"katago", "analysis", "-config", "analysis.cfg", "-model", "default_model.bin"],
     stdin=subprocess.PIPE,
     stdout=subprocess.PIPE,
-    stderr=subprocess.PIPE,
-    text=True,
-    bufsize=1
+    stderr=subprocess.PIPE
 )
 
 # Prepare the corrected request
@@ -28,23 +26,23 @@ request = {
 
 
 # Send it to KataGo
-katago.stdin.write(json.dumps(request) + "\n")
+katago.stdin.write(orjson.dumps(request) + b"\n")
 katago.stdin.flush()
 
 # Read response line by line
-for line in iter(katago.stdout.readline, ''):
+for line in iter(katago.stdout.readline, b''):
     # Check for an empty line, which indicates the process might have closed stdout
     if not line:
         break
-    if '"id":"test1"' in line:
+    if b'"id":"test1"' in line:
         # Pretty-print the JSON response
-        response_json = json.loads(line)
-        print("KataGo response:\n", json.dumps(response_json, indent=2))
+        response_json = orjson.loads(line)
+        print("KataGo response:\n", orjson.dumps(response_json, option=orjson.OPT_INDENT_2).decode())
         break
 
 # Check for any errors on stderr
 error_output = katago.stderr.read()
 if error_output:
-    print("KataGo stderr:\n", error_output)
+    print("KataGo stderr:\n", error_output.decode(errors="replace"))
 
 katago.kill()
@@ -1,12 +1,17 @@
 # katago_api.py
 
+import asyncio
+import concurrent.futures
+import os
 import subprocess
-import json
 import threading
 import queue
 import uuid
 import logging
+import orjson
+from collections import OrderedDict
 from contextlib import asynccontextmanager
+from multiprocessing.connection import Client
 
 from fastapi import FastAPI, HTTPException, Body
 from pydantic import BaseModel, Field
@@ -19,6 +24,15 @@ KATAGO_EXECUTABLE = "katago"
 # Ensure these files are in the same directory as the script, or provide full paths.
 KATAGO_CONFIG = "analysis.cfg"
 KATAGO_MODEL = "default_model.bin"
+# Number of final KataGo responses memoized by move history.
+RESPONSE_CACHE_SIZE = 1024
+# Query fields left out of the cache key; every other field, including nested
+# ones such as overrideSettings, is part of it.
+CACHE_KEY_EXCLUDED_FIELDS = ("id",)
+# If set, the API does not start its own engine but connects to the one owned by
+# katago_supervisord.py on this Unix socket. Read from the environment so every
+# uvicorn worker picks it up.
+KATAGO_ENGINE_SOCKET = os.environ.get("KATAGO_ENGINE_SOCKET")
 
 # --- Logging Setup ---
 logging.basicConfig(
@@ -38,8 +52,17 @@ class KataGoManager:
         self.command = command
         self.process = None
         self.query_queue = queue.Queue()
-        self.response_dict = {}
+        # Maps query ID -> (event, slot). The reader thread drops the final
+        # response into the slot and sets the event to wake the waiter.
+        self.pending: dict[str, tuple[threading.Event, list]] = {}
+        # LRU of final responses keyed by the canonical query (see _cache_key)
+        self.cache: OrderedDict = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
         self.lock = threading.Lock()
+        # query_analysis blocks until KataGo answers, so the API runs it on
+        # these threads to keep the event loop free during the search.
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=32)
         self._stdout_thread = None
         self._stderr_thread = None
         self.is_running = False
@@ -57,8 +80,9 @@ class KataGoManager:
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
-                text=True,
-                bufsize=1  # Line-buffered
+                # Binary pipes: requests go out as orjson bytes and responses are
+                # parsed from bytes, skipping a text encode/decode per message.
+                text=False
             )
             self.is_running = True
             
@@ -89,6 +113,13 @@ class KataGoManager:
         
         if self._stdout_thread: self._stdout_thread.join(timeout=2)
         if self._stderr_thread: self._stderr_thread.join(timeout=2)
+
+        # Queries sent to this process will never be answered; wake their
+        # waiters now instead of letting them sit until the timeout.
+        for query_id in list(self.pending):
+            entry = self.pending.pop(query_id, None)
+            if entry:
+                entry[0].set()
         logging.info("KataGo engine stopped.")
 
     def _read_stdout(self):
@@ -98,20 +129,29 @@ class KataGoManager:
                 line = self.process.stdout.readline()
                 if not line:
                     break
-                response = json.loads(line)
+                # Skip the full parse for in-progress updates: only final
+                # responses and errors are ever handed to a waiter.
+                if b'"isDuringSearch":false' not in line and b'"error"' not in line:
+                    continue
+                response = orjson.loads(line)
+                query_id = response.get("id")
                 # Check for an error field in the response from KataGo
                 if "error" in response:
-                    query_id = response.get("id")
                     logging.error(f"KataGo returned an error for query {query_id}: {response['error']}")
-                    # Store the error response so the waiting thread can see it
-                    if query_id:
-                        self.response_dict[query_id] = response
+                # Only the final response (or an error) wakes the waiting thread
+                elif response.get("isDuringSearch", True):
                     continue
 
-                query_id = response.get("id")
-                if query_id:
-                    self.response_dict[query_id] = response
-            except (json.JSONDecodeError, BrokenPipeError):
+                # Pop rather than get, so an answer that arrives after its waiter
+                # gave up is dropped instead of lingering. This thread never
+                # takes self.lock: a writer holding it may be blocked on a full
+                # stdin pipe until KataGo's stdout is drained.
+                entry = self.pending.pop(query_id, None) if query_id else None
+                if entry:
+                    event, slot = entry
+                    slot.append(response)
+                    event.set()
+            except (orjson.JSONDecodeError, BrokenPipeError):
                 continue
 
     def _read_stderr(self):
@@ -121,50 +161,232 @@ class KataGoManager:
                 line = self.process.stderr.readline()
                 if not line:
                     break
-                logging.warning(f"[KataGo STDERR] {line.strip()}")
+                logging.warning(f"[KataGo STDERR] {line.decode(errors='replace').strip()}")
             except BrokenPipeError:
                 continue
 
+    def _cache_key(self, request_data: dict):
+        """
+        Builds the memoization key for a query: the query itself in canonical form,
+        i.e. serialized with sorted keys, without its id and with the moves cut at the
+        analyzed turn. The stone and move history is kept as-is rather than hashed to a
+        position, since captures, the side to move and ko all depend on the order of
+        play. Returns None for queries that should not be cached.
+        """
+        moves = request_data.get("moves", [])
+        # Without analyzeTurns KataGo analyzes the final position
+        turns = request_data.get("analyzeTurns", [len(moves)])
+        if len(turns) != 1:
+            return None
+        canonical = {name: value for name, value in request_data.items() if name not in CACHE_KEY_EXCLUDED_FIELDS}
+        canonical["initialStones"] = request_data.get("initialStones", [])
+        canonical["moves"] = moves[:turns[0]]
+        canonical["analyzeTurns"] = turns
+        return orjson.dumps(canonical, option=orjson.OPT_SORT_KEYS)
+
+    def cache_stats(self) -> dict:
+        """Returns the response cache's size and hit/miss counters."""
+        return {
+            "size": len(self.cache),
+            "max_size": RESPONSE_CACHE_SIZE,
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+        }
+
     def query_analysis(self, request_data: dict, timeout: int = 180) -> dict:
         """Sends a query to KataGo and waits for the final response."""
         if not self.is_running:
-            raise RuntimeError("KataGo engine is not running.")
+            raise HTTPException(status_code=503, detail="KataGo engine is not available.")
 
         query_id = str(uuid.uuid4())
+        cache_key = self._cache_key(request_data)
+        if cache_key is not None:
+            with self.lock:
+                cached = self.cache.get(cache_key)
+                if cached is not None:
+                    self.cache.move_to_end(cache_key)
+                    self.cache_hits += 1
+                else:
+                    self.cache_misses += 1
+            if cached is not None:
+                return {**cached, "id": query_id}
+
         request_data["id"] = query_id
-        
+        event, slot = threading.Event(), []
+
+        try:
+            with self.lock:
+                self.pending[query_id] = (event, slot)
+                try:
+                    self.process.stdin.write(orjson.dumps(request_data) + b"\n")
+                    self.process.stdin.flush()
+                except BrokenPipeError:
+                    logging.error("Failed to write to KataGo stdin. The process may have crashed.")
+                    # Attempt a restart or handle gracefully
+                    self.stop_engine()
+                    self.start_engine()
+                    raise HTTPException(status_code=503, detail="KataGo engine crashed and is restarting. Please try again.")
+
+            # Wait for the final response
+            if not event.wait(timeout):
+                raise HTTPException(status_code=504, detail=f"KataGo analysis timed out after {timeout} seconds.")
+        finally:
+            # Whatever happened, this query no longer has a waiter, so the
+            # pending map only ever holds queries that are still in flight.
+            with self.lock:
+                self.pending.pop(query_id, None)
+
+        if not slot:
+            raise HTTPException(status_code=503, detail="KataGo engine stopped before answering. Please try again.")
+        response = slot[0]
+        # If KataGo sent back an error, raise it immediately
+        if "error" in response:
+            raise HTTPException(status_code=400, detail=f"KataGo Error: {response['error']}")
+
+        if cache_key is not None:
+            with self.lock:
+                self.cache[cache_key] = response
+                if len(self.cache) > RESPONSE_CACHE_SIZE:
+                    self.cache.popitem(last=False)
+        return response
+
+
+class RemoteKataGoManager:
+    """
+    Drop-in replacement for KataGoManager that forwards queries to a KataGo engine owned by
+    katago_supervisord.py over a Unix domain socket. Several API workers can share one
+    GPU-resident engine, and restarting the API does not reload the neural net.
+    Messages are JSON documents framed by multiprocessing.connection.
+    """
+    def __init__(self, socket_path: str):
+        self.socket_path = socket_path
+        self.conn = None
+        self.pending: dict[str, tuple[threading.Event, list]] = {}
+        self.lock = threading.Lock()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=32)
+        self._reader_thread = None
+        self.is_running = False
+
+    def start_engine(self):
+        """Connects to the engine supervisor and starts the background reader thread."""
+        if self.is_running:
+            logging.warning("Already connected to the KataGo engine supervisor.")
+            return
+
+        logging.info(f"Connecting to KataGo engine supervisor at {self.socket_path}...")
+        try:
+            with self.lock:
+                self._connect()
+        except OSError as e:
+            logging.error(f"FATAL: Cannot connect to the KataGo engine supervisor at '{self.socket_path}': {e}")
+            raise
+        logging.info("Connected to KataGo engine supervisor.")
+
+    def stop_engine(self):
+        """Disconnects from the supervisor. The engine itself keeps running."""
+        if not self.is_running:
+            return
         with self.lock:
+            self._drop_connection(self.conn)
+        logging.info("Disconnected from KataGo engine supervisor.")
+
+    def _connect(self):
+        """Opens a new connection and starts its reader thread. The caller holds self.lock."""
+        self.conn = Client(self.socket_path, family="AF_UNIX")
+        self.is_running = True
+        self._reader_thread = threading.Thread(target=self._read_replies, args=(self.conn,), daemon=True)
+        self._reader_thread.start()
+
+    def _drop_connection(self, conn):
+        """
+        Closes conn and wakes every waiter; their empty slots tell them no reply is coming.
+        Does nothing if conn has already been replaced by a newer connection. The caller
+        holds self.lock.
+        """
+        if conn is not self.conn or not self.is_running:
+            return
+        self.is_running = False
+        # The reader thread is not joined: a blocked recv is not
+        # interrupted by closing the connection from another thread.
+        conn.close()
+        for query_id in list(self.pending):
+            entry = self.pending.pop(query_id, None)
+            if entry:
+                entry[0].set()
+
+    def _read_replies(self, conn):
+        """Continuously reads replies from one connection and hands them to waiters by ID."""
+        while True:
             try:
-                self.process.stdin.write(json.dumps(request_data) + "\n")
-                self.process.stdin.flush()
-            except BrokenPipeError:
-                logging.error("Failed to write to KataGo stdin. The process may have crashed.")
-                # Attempt a restart or handle gracefully
-                self.stop_engine()
-                self.start_engine()
-                raise HTTPException(status_code=503, detail="KataGo engine crashed and is restarting. Please try again.")
-
-        # Wait for the final response
-        import time
-        start_time = time.time()
-        while time.time() - start_time < timeout:
-            if query_id in self.response_dict:
-                response = self.response_dict[query_id]
-                # If KataGo sent back an error, raise it immediately
-                if "error" in response:
-                    del self.response_dict[query_id]
-                    raise HTTPException(status_code=400, detail=f"KataGo Error: {response['error']}")
+                reply = orjson.loads(conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            entry = self.pending.pop(reply.get("id"), None)
+            if entry:
+                event, slot = entry
+                slot.append(reply)
+                event.set()
+        with self.lock:
+            if conn is self.conn and self.is_running:
+                logging.error("Lost connection to the KataGo engine supervisor.")
+            self._drop_connection(conn)
 
-                # The final analysis response has isDuringSearch=false
-                if not response.get("isDuringSearch", True):
-                    del self.response_dict[query_id]
-                    return response
-            time.sleep(0.01) # Small sleep to prevent busy-waiting
+    def _call(self, message: dict, timeout: float) -> dict:
+        """
+        Sends one message to the supervisor and waits for the reply with the same ID.
+        Reconnects first if the connection has been lost, e.g. because the supervisor
+        was restarted, and retries once if the send itself fails.
+        """
+        message_id = str(uuid.uuid4())
+        message["id"] = message_id
+        payload = orjson.dumps(message)
+        try:
+            with self.lock:
+                for _ in range(2):
+                    if not self.is_running:
+                        try:
+                            self._connect()
+                        except OSError as e:
+                            logging.error(f"Cannot reconnect to the KataGo engine supervisor: {e}")
+                            raise HTTPException(status_code=503, detail="KataGo engine supervisor is unreachable. Please try again.")
+                        logging.info("Reconnected to KataGo engine supervisor.")
+                    event, slot = threading.Event(), []
+                    self.pending[message_id] = (event, slot)
+                    try:
+                        self.conn.send_bytes(payload)
+                        break
+                    except OSError:
+                        logging.error("Failed to write to the KataGo engine supervisor.")
+                        self._drop_connection(self.conn)
+                else:
+                    raise HTTPException(status_code=503, detail="KataGo engine supervisor is unreachable. Please try again.")
+            if not event.wait(timeout):
+                raise HTTPException(status_code=504, detail=f"KataGo analysis timed out after {timeout} seconds.")
+        finally:
+            with self.lock:
+                self.pending.pop(message_id, None)
+
+        if not slot:
+            raise HTTPException(status_code=503, detail="KataGo engine supervisor disconnected before answering. Please try again.")
+        reply = slot[0]
+        if "status_code" in reply:
+            raise HTTPException(status_code=reply["status_code"], detail=reply["detail"])
+        return reply["result"]
 
-        # If we exit the loop, it's a timeout
-        if query_id in self.response_dict:
-            del self.response_dict[query_id]
-        raise HTTPException(status_code=504, detail=f"KataGo analysis timed out after {timeout} seconds.")
+    def query_analysis(self, request_data: dict, timeout: int = 180) -> dict:
+        """
+        Sends a query to the supervisor's engine and waits for the final response. The
+        timeout travels with the query so the supervisor can drop it once nobody is
+        waiting for the answer any more.
+        """
+        return self._call({"query": request_data, "timeout": timeout}, timeout)
+
+    def cache_stats(self) -> dict:
+        """Returns the supervisor's response cache statistics, or {} if it is unreachable."""
+        try:
+            return self._call({"cache_stats": True}, timeout=5)
+        except HTTPException:
+            return {}
 
 
 # --- Pydantic Models for API Data Validation ---
@@ -181,13 +403,20 @@ class KataGoQuery(BaseModel):
     initialPlayer: Optional[Literal["b", "w"]] = Field(default=None, description="Player to move first ('b' or 'w'). Crucial if initialStones is used.")
     maxVisits: Optional[int] = Field(default=None, gt=0, description="Maximum analysis visits for KataGo.")
     analyzeTurns: List[int] = Field(default=[0], description="Which turn numbers to analyze.")
+    # Opt-in extras; each adds hundreds of values to the response, so they are omitted unless requested.
+    includeOwnership: Optional[bool] = Field(default=None, description="Include KataGo's predicted ownership map.")
+    includePolicy: Optional[bool] = Field(default=None, description="Include KataGo's raw policy for every move.")
+    includePV: Optional[bool] = Field(default=None, description="Include the principal variation for each candidate move.")
 
 # --- FastAPI Application ---
 
 # Build the command to start KataGo
 katago_command = [KATAGO_EXECUTABLE, "analysis", "-config", KATAGO_CONFIG, "-model", KATAGO_MODEL]
-# Instantiate the manager
-katago_manager = KataGoManager(command=katago_command)
+# Instantiate the manager: our own engine, or a shared one behind the supervisor socket
+if KATAGO_ENGINE_SOCKET:
+    katago_manager = RemoteKataGoManager(KATAGO_ENGINE_SOCKET)
+else:
+    katago_manager = KataGoManager(command=katago_command)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
@@ -211,12 +440,13 @@ async def analyze_position(query: KataGoQuery):
     This endpoint forwards the request to a running KataGo engine.
     The query must conform to the KataGo analysis query format.
     """
-    if not katago_manager.is_running:
-        raise HTTPException(status_code=503, detail="KataGo engine is not available.")
-    
     try:
         # The Pydantic model is automatically converted to a dict
-        analysis_result = katago_manager.query_analysis(query.model_dump(exclude_none=True))
+        analysis_result = await asyncio.get_running_loop().run_in_executor(
+            katago_manager.executor,
+            katago_manager.query_analysis,
+            query.model_dump(exclude_none=True)
+        )
         return analysis_result
     except HTTPException as e:
         # Re-raise HTTP exceptions (like timeouts or KataGo errors)
@@ -228,12 +458,18 @@ async def analyze_position(query: KataGoQuery):
 @app.get("/", summary="Check API status")
 def root():
     """Returns the status of the API and the KataGo engine."""
+    cache = katago_manager.cache_stats()  # May reconnect a remote manager first
     return {
         "status": "online",
-        "katago_engine_running": katago_manager.is_running
+        "katago_engine_running": katago_manager.is_running,
+        "cache": cache
     }
 
 # To run this server:
-# 1. Install necessary packages: pip install fastapi "uvicorn[standard]"
+# 1. Install necessary packages: pip install fastapi "uvicorn[standard]" orjson
 # 2. Save the code as katago_api.py
 # 3. Run from your terminal: uvicorn katago_api:app --host 0.0.0.0 --port 8000
+#
+# To share one engine between several API workers (and keep it loaded across API restarts):
+# 1. Start the engine once: python katago_supervisord.py --socket /tmp/katago.sock
+# 2. Point the API at it:   KATAGO_ENGINE_SOCKET=/tmp/katago.sock uvicorn katago_api:app --workers 4
@@ -0,0 +1,106 @@
+# katago_supervisord.py
+
+import argparse
+import logging
+import os
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import orjson
+from fastapi import HTTPException
+
+from katago_api import KataGoManager, katago_command
+
+# --- Configuration ---
+# The API connects here when started with KATAGO_ENGINE_SOCKET set to the same path.
+DEFAULT_SOCKET_PATH = "/tmp/katago.sock"
+# Seconds a query may take when its client does not say how long it will wait.
+DEFAULT_QUERY_TIMEOUT = 180
+
+
+class EngineSupervisor:
+    """
+    Owns a single KataGo engine (via KataGoManager) and serves it to any number of API
+    processes over a Unix domain socket. Each client message is a JSON document with an
+    "id" and either a "query" (plus the client's "timeout" for it) or a "cache_stats"
+    request; replies echo the same "id".
+    """
+    def __init__(self, manager: KataGoManager, socket_path: str):
+        self.manager = manager
+        self.socket_path = socket_path
+        self.listener = None
+
+    def serve_forever(self):
+        """Starts the engine, then accepts clients until interrupted."""
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Left over from a previous run
+        self.manager.start_engine()
+        self.listener = Listener(self.socket_path, family="AF_UNIX")
+        os.chmod(self.socket_path, 0o600)  # Only the owning user may submit queries
+        logging.info(f"KataGo engine supervisor listening on {self.socket_path}")
+        try:
+            while True:
+                conn = self.listener.accept()
+                threading.Thread(target=self._serve_client, args=(conn,), daemon=True).start()
+        except KeyboardInterrupt:
+            logging.info("Shutting down KataGo engine supervisor...")
+        finally:
+            self.listener.close()
+            self.manager.stop_engine()
+
+    def _serve_client(self, conn):
+        """
+        Reads messages from one client. Cache stats are answered inline so health checks
+        never queue behind analyses; queries run on the manager's thread pool.
+        """
+        logging.info("API client connected.")
+        send_lock = threading.Lock()
+
+        def reply(message: dict):
+            with send_lock:
+                try:
+                    conn.send_bytes(orjson.dumps(message))
+                except OSError:
+                    pass  # Client went away; nothing to deliver to
+
+        def handle(message: dict, deadline: float):
+            message_id = message.get("id")
+            try:
+                # The client gives up at its own timeout, so a query still queued by
+                # then is dropped, and one that starts late only gets the time left.
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.warning(f"Dropping query {message_id}: its client timed out while it was queued.")
+                    return
+                result = self.manager.query_analysis(message["query"], timeout=remaining)
+                reply({"id": message_id, "result": result})
+            except HTTPException as e:
+                reply({"id": message_id, "status_code": e.status_code, "detail": e.detail})
+            except Exception as e:
+                logging.error(f"An unexpected error occurred during analysis: {e}")
+                reply({"id": message_id, "status_code": 500, "detail": "An internal server error occurred."})
+
+        while True:
+            try:
+                message = orjson.loads(conn.recv_bytes())
+            except (EOFError, OSError):
+                break
+            except orjson.JSONDecodeError:
+                logging.warning("Ignoring malformed message from API client.")
+                continue
+            if message.get("cache_stats"):
+                reply({"id": message.get("id"), "result": self.manager.cache_stats()})
+                continue
+            deadline = time.monotonic() + message.get("timeout", DEFAULT_QUERY_TIMEOUT)
+            self.manager.executor.submit(handle, message, deadline)
+        conn.close()
+        logging.info("API client disconnected.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run one KataGo analysis engine and share it with API workers over a Unix socket.")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH, help=f"Unix socket path to listen on (default: {DEFAULT_SOCKET_PATH})")
+    args = parser.parse_args()
+
+    EngineSupervisor(KataGoManager(command=katago_command), args.socket).serve_forever()
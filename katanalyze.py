@@ -1,14 +1,17 @@
 # katanalyze.py (with coordinate system fix)
 
 import json
+import heapq
+import asyncio
 import argparse
 import sys
 import os
 import logging
+import subprocess
 from datetime import datetime
 
-# You must install sgfmill and requests:
-# pip install sgfmill requests
+# You must install sgfmill, requests and orjson:
+# pip install sgfmill requests orjson
 try:
     from sgfmill import sgf
 except ImportError:
@@ -21,6 +24,12 @@ except ImportError:
     print("Error: The 'requests' library is required. Please install it using 'pip install requests'")
     sys.exit(1)
 
+try:
+    import orjson
+except ImportError:
+    print("Error: The 'orjson' library is required. Please install it using 'pip install orjson'")
+    sys.exit(1)
+
 
 # --- CONFIGURATION (Defaults and constants) ---
 # The katago_api.py server must be running and accessible at this URL.
@@ -29,6 +38,20 @@ API_TIMEOUT = 180  # Max time to wait for a response from the API
 LLM_TIMEOUT = 60
 LOGS_DIR = "logs"
 KATAGO_COLUMNS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+# Prompt sent to the LLM; only the player and best move change per call.
+PROMPT_TEMPLATE = ("You are a data extraction robot. Your only task is to read the provided information "
+                   "and output a single sentence in a specific format.\n\n"
+                   "## Data:\n- Player to move: {player}\n- Best Move: {best}\n\n"
+                   "## Task:\nRespond with ONLY the following sentence, filling in the information from the data section. "
+                   "Do not add any other words, explanations, or punctuation.\n\n"
+                   "Sentence format: The best move for [Player to move] is [Best Move].")
+
+# Shared HTTP session so repeated API calls reuse keep-alive connections.
+SESSION = requests.Session()
+SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16))
+# Precomputed GTP coordinates indexed as COORD[row][col], using top-down
+# indexing ('row + 1') so the per-stone work is a single list lookup.
+COORD = [[f"{KATAGO_COLUMNS[c]}{r + 1}" for c in range(25)] for r in range(25)]
 
 
 # --- SCRIPT LOGIC ---
@@ -45,7 +68,10 @@ def parse_sgf_file(filepath):
         logging.error(f"Cannot open or parse SGF file at {filepath}: {e}")
         return None, None, None, None
 
-    root_node = game.get_root()
+    # The root is the first node of the main sequence, so one walk covers
+    # both the setup stones and the moves.
+    sequence = game.get_main_sequence()
+    root_node = sequence[0]
 
     # Correctly determine the initial player for handicap games.
     initial_player = "B"
@@ -56,46 +82,27 @@ def parse_sgf_file(filepath):
     elif root_node.has_property('AB'):
         initial_player = "W"
 
-    initial_stones = []
-    if root_node.has_property('AB') or root_node.has_property('AW'):
-        (black_stones, white_stones, _) = root_node.get_setup_stones()
-        for row, col in black_stones:
-            katago_col = KATAGO_COLUMNS[col]
-            # --- COORDINATE FIX ---
-            # Changed from 'board_size - row' to 'row + 1' to use top-down indexing.
-            katago_row = row + 1
-            initial_stones.append(["B", f"{katago_col}{katago_row}"])
-        for row, col in white_stones:
-            katago_col = KATAGO_COLUMNS[col]
-            # --- COORDINATE FIX ---
-            # Changed from 'board_size - row' to 'row + 1' to use top-down indexing.
-            katago_row = row + 1
-            initial_stones.append(["W", f"{katago_col}{katago_row}"])
+    # get_setup_stones() returns empty sets when there is no AB/AW property.
+    black_stones, white_stones, _ = root_node.get_setup_stones()
+    initial_stones = [["B", COORD[row][col]] for row, col in black_stones]
+    initial_stones += [["W", COORD[row][col]] for row, col in white_stones]
 
     moves = []
-    try:
-        for node in game.get_main_sequence():
-            prop, move_coords = "", None
-            if node.has_property("B"):
-                prop, move_coords = "B", node.get("B")
-            elif node.has_property("W"):
-                prop, move_coords = "W", node.get("W")
-            else:
-                continue
-
-            if move_coords is None:
-                moves.append([prop, "pass"])
-                continue
-
+    for i, node in enumerate(sequence):
+        # A malformed node only loses that node, not the whole game.
+        try:
+            color, move_coords = node.get_move()
+        except ValueError as e:
+            logging.warning(f"Skipping malformed SGF node {i}: {e}")
+            continue
+        if color is None:
+            continue
+
+        if move_coords is None:
+            moves.append([color.upper(), "pass"])
+        else:
             row, col = move_coords
-            katago_col = KATAGO_COLUMNS[col]
-            # --- COORDINATE FIX ---
-            # Changed from 'board_size - row' to 'row + 1' to use top-down indexing.
-            katago_row = row + 1
-            moves.append([prop, f"{katago_col}{katago_row}"])
-    except Exception as e:
-        logging.error(f"Error parsing SGF move sequence: {e}")
-        return None, None, None, None
+            moves.append([color.upper(), COORD[row][col]])
 
     return board_size, initial_stones, moves, initial_player
 
@@ -116,17 +123,18 @@ def request_katago_analysis_from_api(board_size, initial_stones, moves, initial_
     }
 
     logging.info(f"Sending query to KataGo API at {KATAGO_API_URL}")
-    logging.debug(f"Constructed API Query: {json.dumps(katago_query)}")
+    logging.debug(f"Constructed API Query: {orjson.dumps(katago_query).decode()}")
 
     try:
-        response = requests.post(
+        response = SESSION.post(
             KATAGO_API_URL,
-            json=katago_query,
+            data=orjson.dumps(katago_query),
+            headers={"Content-Type": "application/json"},
             timeout=API_TIMEOUT
         )
         response.raise_for_status()
         logging.info("Full analysis received from KataGo API.")
-        return response.json()
+        return orjson.loads(response.content)
     except requests.exceptions.ConnectionError:
         logging.error(f"Connection Error: Could not connect to the KataGo API at {KATAGO_API_URL}.")
         logging.error("Please ensure the katago_api.py server is running and accessible.")
@@ -147,18 +155,21 @@ def request_katago_analysis_from_api(board_size, initial_stones, moves, initial_
         return None
 
 
-def get_ranked_moves(kata_output_json):
-    """Parses the KataGo JSON and sorts all moves."""
+def get_ranked_moves(kata_output_json, top_k=None):
+    """Parses the KataGo JSON and sorts all moves, or picks just the best `top_k`."""
     move_infos = kata_output_json.get('moveInfos', [])
     if not move_infos:
         logging.error("No 'moveInfos' key found in the KataGo JSON data.")
         return []
-    return sorted(move_infos, key=lambda x: (x.get('playSelectionValue', 0), x.get('visits', 0)), reverse=True)
+    rank_key = lambda x: (x.get('playSelectionValue', 0), x.get('visits', 0))
+    if top_k is not None:
+        return heapq.nlargest(top_k, move_infos, key=rank_key)
+    return sorted(move_infos, key=rank_key, reverse=True)
 
 
 def generate_move_table(kata_output):
     """Generates a markdown table with Move, PlaySelectionValue, and Visits."""
-    ranked_moves = get_ranked_moves(kata_output)
+    ranked_moves = get_ranked_moves(kata_output, top_k=5)
     if not ranked_moves: return "No moves to display."
     
     table = "| Rank | Move | PlaySelectionValue | Visits |\n"
@@ -171,23 +182,16 @@ def generate_move_table(kata_output):
 
 def format_prompt_for_llm(kata_output):
     """Creates a simple, direct prompt to force the LLM to extract specific data."""
-    ranked_moves = get_ranked_moves(kata_output)
+    ranked_moves = get_ranked_moves(kata_output, top_k=1)
     if not ranked_moves: return "The board is empty."
     root_info = kata_output.get("rootInfo", {})
     current_player = "Black" if root_info.get("currentPlayer") == "B" else "White"
     best_move = ranked_moves[0].get("move", "N/A")
-    prompt = (f"You are a data extraction robot. Your only task is to read the provided information "
-              f"and output a single sentence in a specific format.\n\n"
-              f"## Data:\n- Player to move: {current_player}\n- Best Move: {best_move}\n\n"
-              f"## Task:\nRespond with ONLY the following sentence, filling in the information from the data section. "
-              f"Do not add any other words, explanations, or punctuation.\n\n"
-              f"Sentence format: The best move for [Player to move] is [Best Move].")
-    return prompt
+    return PROMPT_TEMPLATE.format(player=current_player, best=best_move)
 
 
 def ask_llm(prompt, model_name):
     """Sends the prompt to the specified local LLM via Ollama."""
-    import subprocess
     logging.info(f"Sending prompt to LLM model: {model_name}")
     try:
         result = subprocess.run(['ollama', 'run', model_name], input=prompt, capture_output=True, text=True,
@@ -204,48 +208,29 @@ def ask_llm(prompt, model_name):
         return e.stdout.strip().split('\n')[0] if e.stdout else "The LLM timed out."
 
 
-def main():
-    analysis_id = datetime.now().strftime('%Y%m%d-%H%M%S')
-    os.makedirs(LOGS_DIR, exist_ok=True)
-    log_file_path = os.path.join(LOGS_DIR, f'go-analysis-{analysis_id}.log')
-    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
-                        handlers=[logging.FileHandler(log_file_path), logging.StreamHandler(sys.stdout)])
-
-    parser = argparse.ArgumentParser(
-        description="Analyze a specific move in a Go SGF file using a KataGo API and a specified LLM.",
-        formatter_class=argparse.RawTextHelpFormatter,
-        epilog=("Example Usage:\n"
-                "  python katanalyze.py llama3 gut --move 25 \"path/to/your game.sgf\"\n"
-                "  python katanalyze.py gemma2:9b deepread --move 0 \"C:\\GoGames\\game1.sgf\""))
-    parser.add_argument("llm_model", help="The name of the Ollama model to use (e.g., 'gemma2:9b', 'llama3').")
-    parser.add_argument("visits_level", choices=['gut', 'read', 'deepread'],
-                        help="The analysis depth:\n  gut      - 500 visits\n  read     - 1000 visits\n  deepread - 10000 visits")
-    parser.add_argument("sgf_file", help="Path to the SGF file to analyze.")
-    parser.add_argument("--move", type=int, required=True,
-                        help="The move number to analyze. Use 0 for the initial board position. This is a required argument.")
-    args = parser.parse_args()
-
-    visits_map = {'gut': 500, 'read': 1000, 'deepread': 10000}
-    katago_visits = visits_map[args.visits_level]
-    move_to_analyze = args.move
-
-    logging.info(f"Loading SGF file: {args.sgf_file}...")
-    board_size, initial_stones, all_moves, initial_player = parse_sgf_file(args.sgf_file)
+async def analyze_sgf(sgf_file, move_to_analyze, katago_visits, visits_level, llm_model, log_file_path):
+    """
+    Runs the parse -> KataGo -> LLM pipeline for one SGF file. The blocking steps run in
+    worker threads so several files can be in flight at once. Returns True on success.
+    """
+    logging.info(f"Loading SGF file: {sgf_file}...")
+    board_size, initial_stones, all_moves, initial_player = await asyncio.to_thread(parse_sgf_file, sgf_file)
     if board_size is None:
-        sys.exit(1)
+        return False
 
     if move_to_analyze < 0 or move_to_analyze > len(all_moves):
-        logging.error(f"Invalid move number: {move_to_analyze}. The game has {len(all_moves)} moves.")
+        logging.error(f"Invalid move number for {sgf_file}: {move_to_analyze}. The game has {len(all_moves)} moves.")
         logging.error(f"Please provide a move number between 0 and {len(all_moves)}.")
-        sys.exit(1)
+        return False
 
     moves_up_to_target = all_moves[:move_to_analyze]
 
-    logging.info(f"Analyzing position at move {move_to_analyze}.")
+    logging.info(f"Analyzing position at move {move_to_analyze} of {sgf_file}.")
     logging.info(f"Found board size {board_size}x{board_size}, {len(initial_stones)} setup stones, and sending {len(moves_up_to_target)} moves to the engine.")
-    logging.info(f"Requesting KataGo analysis via API with {katago_visits} visits (Level: {args.visits_level})...")
+    logging.info(f"Requesting KataGo analysis via API with {katago_visits} visits (Level: {visits_level})...")
 
-    kata_result = request_katago_analysis_from_api(
+    kata_result = await asyncio.to_thread(
+        request_katago_analysis_from_api,
         board_size,
         initial_stones,
         moves_up_to_target,
@@ -255,30 +240,69 @@ def main():
     )
 
     if kata_result is None:
-        logging.error("Exiting due to failed KataGo analysis. Check logs for details.")
-        sys.exit(1)
-
-    with open(log_file_path, 'a') as f:
-        f.write("\n--- KATA GO RAW ANALYSIS (from API) ---\n")
-        json.dump(kata_result, f, indent=2)
-        f.write("\n\n--- MOVE ANALYSIS TABLE ---\n")
-        f.write(generate_move_table(kata_result))
-        f.write("--------------------------\n\n")
+        logging.error(f"KataGo analysis failed for {sgf_file}. Check logs for details.")
+        return False
 
     prompt = format_prompt_for_llm(kata_result)
-    
-    with open(log_file_path, 'a') as f:
-        f.write(f"--- PROMPT FOR {args.llm_model.upper()} ---\n{prompt}\n---------------------------\n\n")
-
-    response = ask_llm(prompt, args.llm_model)
-    with open(log_file_path, 'a') as f:
-        f.write(f"--- RESPONSE FROM {args.llm_model.upper()} ---\n{response}\n---------------------------\n")
+    response = await asyncio.to_thread(ask_llm, prompt, llm_model)
+
+    # Write the raw analysis, table, prompt and response in a single append.
+    with open(log_file_path, 'ab') as f:
+        f.write(f"\n=== SGF FILE: {sgf_file} (move {move_to_analyze}) ===\n".encode())
+        f.write(b"\n--- KATA GO RAW ANALYSIS (from API) ---\n")
+        f.write(orjson.dumps(kata_result, option=orjson.OPT_INDENT_2))
+        f.write((f"\n\n--- MOVE ANALYSIS TABLE ---\n"
+                 f"{generate_move_table(kata_result)}"
+                 f"--------------------------\n\n"
+                 f"--- PROMPT FOR {llm_model.upper()} ---\n{prompt}\n---------------------------\n\n"
+                 f"--- RESPONSE FROM {llm_model.upper()} ---\n{response}\n---------------------------\n").encode())
 
     print("\n" + "="*80)
-    print(f"LLM ({args.llm_model}) Response for move {move_to_analyze}:")
+    print(f"LLM ({llm_model}) Response for move {move_to_analyze} of {sgf_file}:")
     print(response)
     print("="*80 + "\n")
+    return True
+
+
+async def amain():
+    analysis_id = datetime.now().strftime('%Y%m%d-%H%M%S')
+    os.makedirs(LOGS_DIR, exist_ok=True)
+    log_file_path = os.path.join(LOGS_DIR, f'go-analysis-{analysis_id}.log')
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s',
+                        handlers=[logging.FileHandler(log_file_path), logging.StreamHandler(sys.stdout)])
+
+    parser = argparse.ArgumentParser(
+        description="Analyze a specific move in one or more Go SGF files using a KataGo API and a specified LLM.",
+        formatter_class=argparse.RawTextHelpFormatter,
+        epilog=("Example Usage:\n"
+                "  python katanalyze.py llama3 gut --move 25 \"path/to/your game.sgf\"\n"
+                "  python katanalyze.py gemma2:9b deepread --move 0 \"C:\\GoGames\\game1.sgf\"\n"
+                "  python katanalyze.py llama3 read --move 50 game1.sgf game2.sgf game3.sgf"))
+    parser.add_argument("llm_model", help="The name of the Ollama model to use (e.g., 'gemma2:9b', 'llama3').")
+    parser.add_argument("visits_level", choices=['gut', 'read', 'deepread'],
+                        help="The analysis depth:\n  gut      - 500 visits\n  read     - 1000 visits\n  deepread - 10000 visits")
+    parser.add_argument("sgf_files", nargs='+', metavar="sgf_file",
+                        help="Path to the SGF file to analyze. Several files are analyzed concurrently.")
+    parser.add_argument("--move", type=int, required=True,
+                        help="The move number to analyze. Use 0 for the initial board position. This is a required argument.")
+    args = parser.parse_args()
+
+    visits_map = {'gut': 500, 'read': 1000, 'deepread': 10000}
+    katago_visits = visits_map[args.visits_level]
+
+    results = await asyncio.gather(*(
+        analyze_sgf(sgf_file, args.move, katago_visits, args.visits_level, args.llm_model, log_file_path)
+        for sgf_file in args.sgf_files
+    ))
+
     print(f"Full analysis log saved to: {log_file_path}")
+    if not all(results):
+        logging.error("Some analyses failed. Check logs for details.")
+        sys.exit(1)
+
+
+def main():
+    asyncio.run(amain())
 
 
 if __name__ == "__main__":
@@ -1,9 +1,14 @@
 import subprocess
+import asyncio
+import atexit
+import hashlib
 import json
+import shelve
 import argparse
 import sys
 import os
 import logging
+import logging.handlers
 from datetime import datetime
 
 # You must install sgfmill: pip install sgfmill
@@ -13,12 +18,45 @@ except ImportError:
     print("Error: The 'sgfmill' library is required. Please install it using 'pip install sgfmill'")
     sys.exit(1)
 
+# You must install the Ollama client: pip install ollama
+try:
+    import ollama
+except ImportError:
+    print("Error: The 'ollama' library is required. Please install it using 'pip install ollama'")
+    sys.exit(1)
+
+# You must install orjson: pip install orjson
+try:
+    import orjson
+except ImportError:
+    print("Error: The 'orjson' library is required. Please install it using 'pip install orjson'")
+    sys.exit(1)
+
 # --- CONFIGURATION ---
+KATAGO_COLUMNS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
 KATAGO_COMMAND = [
     "katago", "analysis", "-model", "default_model.bin", "-config", "analysis.cfg"
 ]
-GEMMA_TIMEOUT = 15 # Seconds to wait for Gemma before timing out
+GEMMA_MODEL = "gemma"
+GEMMA_TIMEOUT = 15 # Seconds one Gemma generation may take, not counting time queued
+# Requests kept in flight at once. Match the server's OLLAMA_NUM_PARALLEL, which is a
+# server-side setting: set it in the environment of `ollama serve`, not here.
+OLLAMA_PARALLEL = 4
+
+# The part of every Gemma conversation that never changes. It is sent first, as the
+# system message, so Ollama can reuse its cached prefix across requests and only has
+# to process the short per-position message that follows.
+SYSTEM_PROMPT = (
+    "You are a Go Grandmaster providing a quick, expert opinion.\n\n"
+    "You will be given KataGo analysis data for a position. Based on this data, provide a "
+    "three-sentence summary for the current player. Explain the most important move and "
+    "the immediate strategic goal."
+)
 LOGS_DIR = "logs"
+# KataGo and Gemma responses are kept here between runs, keyed by a hash of
+# everything that determines them (see katago_cache_key and gemma_cache_key).
+KATAGO_CACHE_PATH = os.path.join(LOGS_DIR, "katago_cache")
+GEMMA_CACHE_PATH = os.path.join(LOGS_DIR, "gemma_cache")
 
 # Base structure for the KataGo query. Moves and a unique ID will be added to this.
 KATAGO_INPUT = {
@@ -42,28 +80,15 @@ def parse_sgf_moves(filepath):
         logging.error(f"Cannot open SGF file at {filepath}")
         return None
 
-    moves = []
     board_size = game.get_size()
-    SGF_COLUMNS = "abcdefghijklmnopqrstuvwxyz"
-    KATAGO_COLUMNS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+    # GTP vertex for every (row, col), built once per game instead of per move
+    vertex = [[f"{KATAGO_COLUMNS[col]}{board_size - row}" for col in range(board_size)]
+              for row in range(board_size)]
 
     try:
-        for node in game.get_main_sequence():
-            if node.has_property("B"):
-                player, move_coords = "B", node.get("B")
-            elif node.has_property("W"):
-                player, move_coords = "W", node.get("W")
-            else:
-                continue
-            
-            if move_coords is None:
-                moves.append([player, "pass"])
-                continue
-
-            row, col = move_coords
-            katago_col = KATAGO_COLUMNS[col]
-            katago_row = board_size - row
-            moves.append([player, f"{katago_col}{katago_row}"])
+        moves = [[color.upper(), vertex[move[0]][move[1]] if move else "pass"]
+                 for color, move in (node.get_move() for node in game.get_main_sequence())
+                 if color is not None]
     except Exception as e:
         logging.error(f"Error parsing SGF file: {e}")
         return None
@@ -74,51 +99,193 @@ def get_manual_moves():
     """Returns a hard-coded list of moves for analysis if no SGF is provided."""
     return [["B", "Q16"], ["W", "D4"], ["B", "Q4"]]
 
+class KatagoEngine:
+    """
+    A long-lived KataGo analysis process. The model is loaded once when the engine
+    starts; each query is then a single line on stdin, matched to its response by "id".
+    """
+    def __init__(self, command=KATAGO_COMMAND):
+        self.command = command
+        self.proc = None
+
+    def start(self):
+        """Starts KataGo and registers close() to run at interpreter exit."""
+        if self.proc is not None:
+            return
+        logging.info("Starting KataGo analysis engine...")
+        self.proc = subprocess.Popen(
+            self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL, text=True, bufsize=1
+        )
+        atexit.register(self.close)
+
+    def query(self, input_data):
+        """Sends a query and returns the final response with the same id, or None."""
+        return self.query_many([input_data]).get(input_data["id"])
+
+    def query_many(self, queries):
+        """
+        Sends every query up front so KataGo can search the positions side by side and
+        batch their neural-net evaluations, then collects the final responses into a
+        dict keyed by id. Queries that fail or go unanswered are missing from the dict.
+        """
+        self.start()
+        try:
+            for input_data in queries:
+                self.proc.stdin.write(json.dumps(input_data) + "\n")
+            self.proc.stdin.flush()
+        except BrokenPipeError:
+            logging.error("KataGo is not running; could not send the queries.")
+            return {}
+
+        waiting = {input_data["id"] for input_data in queries}
+        responses = {}
+        for line in self.proc.stdout:
+            response = json.loads(line)
+            query_id = response.get("id")
+            if query_id not in waiting:
+                continue
+            if "error" in response:
+                logging.error(f"KataGo rejected query {query_id}: {response['error']}")
+                waiting.discard(query_id)
+            # Warnings (e.g. an unused field) share the query's id; the analysis still follows
+            elif "warning" in response:
+                logging.warning(f"KataGo warned about query {query_id}: {response['warning']}")
+            elif not response.get("isDuringSearch", True):
+                responses[query_id] = response
+                waiting.discard(query_id)
+            if not waiting:
+                break
+
+        if waiting:
+            logging.error(f"KataGo exited without answering {len(waiting)} queries.")
+        return responses
+
+    def close(self):
+        """Closes stdin so KataGo finishes and exits, then waits for it."""
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+            self.proc.wait(timeout=5)
+        except (BrokenPipeError, subprocess.TimeoutExpired):
+            self.proc.kill()
+        self.proc = None
+
+katago_engine = KatagoEngine()
+
+def katago_cache_key(input_data):
+    """
+    Hashes the engine command (model and config) and the query in canonical form: every
+    field but "id", serialized with sorted keys. Two queries share a key exactly when
+    KataGo would give them the same analysis.
+    """
+    query = json.dumps({name: value for name, value in input_data.items() if name != "id"},
+                       sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(f"{KATAGO_COMMAND}\n{query}".encode()).hexdigest()
+
+def run_katago_many(queries):
+    """
+    Analyzes queries with the shared KataGo engine and returns the final responses in a
+    dict keyed by query id. Queries answered in an earlier run come from the on-disk
+    cache, and identical queries are only sent once; the rest go to KataGo together in
+    one batch. Failed queries are missing from the dict and are not cached.
+    """
+    keys = {query["id"]: katago_cache_key(query) for query in queries}
+    with shelve.open(KATAGO_CACHE_PATH) as cache:
+        to_send = {}
+        for query in queries:
+            if keys[query["id"]] not in cache:
+                to_send.setdefault(keys[query["id"]], query)
+        distinct = len(set(keys.values()))
+        logging.info(f"{distinct - len(to_send)} of {distinct} distinct KataGo position(s) answered from cache.")
+        if to_send:
+            responses = katago_engine.query_many(list(to_send.values()))
+            for key, query in to_send.items():
+                if query["id"] in responses:
+                    cache[key] = responses[query["id"]]
+        # The caller's id goes on each copy, whichever query the response was cached under
+        return {query_id: {**cache[key], "id": query_id} for query_id, key in keys.items() if key in cache}
+
 def run_katago(input_data):
-    """Sends a query to the KataGo analysis engine."""
-    proc = subprocess.Popen(
-        KATAGO_COMMAND, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE, text=True
-    )
-    input_json = json.dumps(input_data) + "\n"
-    stdout_data, stderr_data = proc.communicate(input_json)
-    
-    lines = stdout_data.strip().split("\n")
-    for line in lines:
-        if f'"id":"{input_data["id"]}"' in line:
-            return json.loads(line)
-    
-    logging.error(f"No valid KataGo response found.\nSTDOUT: {stdout_data}\nSTDERR: {stderr_data}")
-    return None
+    """Sends one query to the shared KataGo engine; see run_katago_many()."""
+    return run_katago_many([input_data]).get(input_data["id"])
 
 def format_prompt(kata_output):
-    """Formats the data and creates a CONCISE prompt for Gemma."""
+    """Formats the position-specific part of the prompt for Gemma; see SYSTEM_PROMPT."""
     moves = kata_output.get("moveInfos", [])
     if not moves:
         return "The board is empty. In three sentences, describe the most common 3-3 point invasion opening."
 
     best_move = moves[0]
-    prompt = "You are a Go Grandmaster providing a quick, expert opinion.\n\n"
-    prompt += "## Analysis Data\n"
+    prompt = "## Analysis Data\n"
     prompt += f"- Current Score: Black leads by {kata_output.get('scoreLead', 0.0):.1f} points.\n"
     prompt += f"- Best Move: {best_move['move']}\n"
-    prompt += f"- Winrate after Best Move: {best_move['winrate']*100:.1f}%\n\n"
-    prompt += "## Your Task\n"
-    prompt += "Based on this data, provide a three-sentence summary for the current player. Explain the most important move and the immediate strategic goal."
+    prompt += f"- Winrate after Best Move: {best_move['winrate']*100:.1f}%\n"
     return prompt
 
-def ask_gemma(prompt):
-    """Sends the prompt to Gemma via Ollama with a timeout."""
+def gemma_messages(prompt):
+    """Builds the chat messages for one prompt: the shared system prompt, then the prompt."""
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+async def warm_up_gemma(client):
+    """
+    Loads Gemma and has it process SYSTEM_PROMPT once, so the requests that follow
+    start from a cached prefix instead of each processing it in parallel.
+    keep_alive=-1 keeps the model loaded after this process exits.
+    """
     try:
-        result = subprocess.run(
-            ['ollama', 'run', 'gemma'],
-            input=prompt, capture_output=True, text=True,
-            timeout=GEMMA_TIMEOUT, check=False
+        await client.chat(model=GEMMA_MODEL, messages=[{"role": "system", "content": SYSTEM_PROMPT}], keep_alive=-1)
+    except Exception as e:
+        logging.warning(f"Gemma warm-up failed: {e!r}")
+
+async def ask_gemma(client, semaphore, prompt):
+    """
+    Sends one prompt once a slot is free. GEMMA_TIMEOUT applies from then on, so
+    waiting behind the other prompts does not count against it.
+    """
+    async with semaphore:
+        return await asyncio.wait_for(
+            client.chat(model=GEMMA_MODEL, messages=gemma_messages(prompt), keep_alive=-1),
+            timeout=GEMMA_TIMEOUT
         )
-        return result.stdout
-    except subprocess.TimeoutExpired as e:
-        logging.warning(f"Gemma timed out after {GEMMA_TIMEOUT} seconds. Returning partial output.")
-        return e.stdout if e.stdout else "Gemma timed out and produced no output."
+
+def gemma_cache_key(prompt):
+    """Hashes everything that determines Gemma's answer: the model and both messages."""
+    return hashlib.sha256(f"{GEMMA_MODEL}\n{SYSTEM_PROMPT}\n{prompt}".encode()).hexdigest()
+
+async def ask_gemma_many(prompts):
+    """
+    Sends all prompts to Gemma through the Ollama HTTP API, at most OLLAMA_PARALLEL at a
+    time, and returns the responses in the same order. Prompts answered in an earlier
+    run come from the on-disk cache, and identical prompts are only sent once. A prompt
+    that fails or times out gets a short explanation in place of its response.
+    """
+    keys = [gemma_cache_key(prompt) for prompt in prompts]
+    with shelve.open(GEMMA_CACHE_PATH) as cache:
+        prompt_for_key = dict(zip(keys, prompts))
+        missing = [key for key in prompt_for_key if key not in cache]
+        logging.info(f"{len(prompt_for_key) - len(missing)} of {len(prompt_for_key)} distinct Gemma prompt(s) answered from cache.")
+        if missing:
+            # No client-wide timeout: it would also count the time a request waits for a slot
+            async with ollama.AsyncClient(timeout=None) as client:
+                if len(missing) > 1:
+                    # Only worth it when several requests would share the prefix
+                    await warm_up_gemma(client)
+                semaphore = asyncio.Semaphore(OLLAMA_PARALLEL)
+                results = await asyncio.gather(
+                    *[ask_gemma(client, semaphore, prompt_for_key[key]) for key in missing],
+                    return_exceptions=True
+                )
+            for key, result in zip(missing, results):
+                if isinstance(result, Exception):
+                    logging.warning(f"Gemma request failed: {result!r}")
+                else:
+                    cache[key] = result["message"]["content"]
+        return [cache.get(key, "Gemma timed out or failed and produced no output.") for key in keys]
 
 def main():
     # --- 1. Set up Logging and Unique ID ---
@@ -126,18 +293,25 @@ def main():
     os.makedirs(LOGS_DIR, exist_ok=True)
     log_file_path = os.path.join(LOGS_DIR, f'{analysis_id}.log')
 
+    # File records are buffered and written in batches; errors and exit flush them at once.
+    file_log = logging.handlers.MemoryHandler(
+        capacity=1000, flushLevel=logging.ERROR, target=logging.FileHandler(log_file_path)
+    )
     logging.basicConfig(
         level=logging.INFO,
         format='%(asctime)s [%(levelname)s] %(message)s',
         handlers=[
-            logging.FileHandler(log_file_path),
+            file_log,
             logging.StreamHandler(sys.stdout) # To see logs in console too
         ]
     )
+    # basicConfig only formats the handlers it is given; the file handler sits behind file_log
+    file_log.target.setFormatter(file_log.formatter)
 
     # --- 2. Process Input ---
     parser = argparse.ArgumentParser(description="Analyze a Go position using KataGo and Gemma.")
     parser.add_argument("sgf_file", nargs='?', default=None, help="Optional path to an SGF file to analyze.")
+    parser.add_argument("--every-move", action="store_true", help="Also analyze every earlier position of the game, in one batch.")
     args = parser.parse_args()
 
     if args.sgf_file:
@@ -155,34 +329,49 @@ def main():
 
     # --- 3. Run KataGo Analysis ---
     logging.info("Running KataGo analysis...")
-    kata_result = run_katago(KATAGO_INPUT)
+    if args.every_move:
+        # One query per position, all in flight together; the last one is the full game.
+        queries = [{**KATAGO_INPUT, "id": f"{analysis_id}-{i}", "moves": moves_to_analyze[:i]}
+                   for i in range(len(moves_to_analyze) + 1)]
+        logging.info(f"Batching {len(queries)} positions into one KataGo run...")
+        responses = run_katago_many(queries)
+        results = [responses[query["id"]] for query in queries if query["id"] in responses]
+        kata_result = responses.get(queries[-1]["id"])
+    else:
+        kata_result = run_katago(KATAGO_INPUT)
+        results = [kata_result]
     if kata_result is None:
         logging.error("Exiting due to failed KataGo analysis.")
         sys.exit(1)
         
     logging.info("KataGo analysis successful.")
-    # Log the full JSON from KataGo to the file
-    logging.getLogger().handlers[0].flush() # Ensure buffer is written
-    with open(log_file_path, 'a') as f:
-        f.write("\n--- KATA GO ANALYSIS JSON ---\n")
-        json.dump(kata_result, f, indent=2)
-        f.write("\n---------------------------\n\n")
-
-    # --- 4. Build and Send Prompt to Gemma ---
+    # Log the full JSON from KataGo to the file, after the records buffered so far: one
+    # block per analyzed position, in game order, so the full game's comes last
+    file_log.flush()
+    with open(log_file_path, 'ab') as f:
+        for result in results:
+            f.write(b"\n--- KATA GO ANALYSIS JSON ---\n"
+                    + orjson.dumps(result, option=orjson.OPT_INDENT_2)
+                    + b"\n---------------------------\n\n")
+
+    # --- 4. Build and Send Prompts to Gemma ---
     logging.info("Building prompt for Gemma...")
-    prompt = format_prompt(kata_result)
+    # One prompt per analyzed position, in game order; the last is the full game.
+    prompts = [format_prompt(result) for result in results]
 
-    # Log the prompt that will be sent
-    logging.info(f"--- PROMPT FOR GEMMA ---\n{prompt}\n------------------------")
+    # Log the prompts that will be sent
+    for result, prompt in zip(results, prompts):
+        logging.info(f"--- PROMPT FOR GEMMA ({result['id']}) ---\n{prompt}\n------------------------")
     
-    logging.info(f"Sending to Gemma via Ollama (timeout in {GEMMA_TIMEOUT} seconds)...")
-    response = ask_gemma(prompt)
+    logging.info(f"Sending {len(prompts)} prompt(s) to Gemma via Ollama ({OLLAMA_PARALLEL} at a time, {GEMMA_TIMEOUT} seconds each)...")
+    responses = asyncio.run(ask_gemma_many(prompts))
     
-    # Log the final response from Gemma
-    logging.info(f"--- RESPONSE FROM GEMMA ---\n{response}\n-------------------------")
+    # Log the responses from Gemma
+    for result, response in zip(results, responses):
+        logging.info(f"--- RESPONSE FROM GEMMA ({result['id']}) ---\n{response}\n-------------------------")
     
     print("\n🧠 Gemma's concise explanation:\n")
-    print(response)
+    print(responses[-1])
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -1,14 +1,113 @@
-import collections
 import argparse
+import functools
+import numpy as np
+from scipy.ndimage import label
 from sgfmill import sgf
 
+# Board cell values. The board is an N x N uint8 array: one byte per point.
+EMPTY, BLACK, WHITE = 0, 1, 2
+# Public methods take SGF-style colors ('b'/'w'); internally they are cell values.
+COLOR_VALUE = {'b': BLACK, 'w': WHITE}
+OPPONENT = {BLACK: WHITE, WHITE: BLACK}
+# Orthogonal neighbor offsets.
+D4 = ((0, 1), (0, -1), (1, 0), (-1, 0))
+# Board columns skip 'I', as in GTP; COL_INDEX maps a lowercase column letter to its index.
+KATAGO_COLUMNS = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
+COL_INDEX = {col: i for i, col in enumerate(KATAGO_COLUMNS.lower())}
+# Character for each cell value, indexed by the board array to render it.
+STONE_CHAR = np.array(['.', 'X', 'O'])
+# Shape patterns: (dr, dc) offsets from the move that must all hold stones of one color.
+# Each *_PATTERNS tuple lists the orientations of a shape; a match on any of them counts.
+PEEP_PATTERNS = (((-1, 0), (1, 0)), ((0, -1), (0, 1)))  # Opponent stones either side
+BAMBOO_JOINT_PATTERNS = (
+    ((0, -2), (1, 0), (1, -2)), ((0, -2), (-1, 0), (-1, -2)),  # Horizontal joint to the left
+    ((0, 2), (1, 0), (1, 2)), ((0, 2), (-1, 0), (-1, 2)),      # Horizontal joint to the right
+    ((-2, 0), (0, 1), (-2, 1)), ((-2, 0), (0, -1), (-2, -1)),  # Vertical joint above
+    ((2, 0), (0, 1), (2, 1)), ((2, 0), (0, -1), (2, -1)),      # Vertical joint below
+)
+EMPTY_TRIANGLE_PATTERNS = (((0, -1), (-1, 0)), ((-1, 0), (0, 1)), ((0, 1), (1, 0)), ((1, 0), (0, -1)))
+TIGER_MOUTH_PATTERNS = (((-1, -1), (1, -1)), ((-1, 1), (1, 1)), ((1, -1), (1, 1)), ((-1, -1), (-1, 1)))
+ONE_POINT_JUMP_PATTERN = ((-2, 0), (2, 0), (0, -2), (0, 2))
+ADJACENT_PATTERN = ((-1, 0), (1, 0), (0, -1), (0, 1))
+KNIGHTS_MOVE_PATTERN = ((1, 2), (1, -2), (-1, 2), (-1, -2), (2, 1), (2, -1), (-2, 1), (-2, -1))
+DIAGONAL_PATTERN = ((1, 1), (1, -1), (-1, 1), (-1, -1))
+# Every pattern above, for precomputing their masks.
+SHAPE_PATTERNS = (PEEP_PATTERNS + BAMBOO_JOINT_PATTERNS + EMPTY_TRIANGLE_PATTERNS + TIGER_MOUTH_PATTERNS +
+                  (ONE_POINT_JUMP_PATTERN, ADJACENT_PATTERN, KNIGHTS_MOVE_PATTERN, DIAGONAL_PATTERN))
+# Connectivity for scipy.ndimage.label: stones connect orthogonally only.
+FOUR_CONNECTED = np.array([[0, 1, 0], [1, 1, 1], [0, 1, 0]], dtype=bool)
+
+
+def label_groups(board, color):
+    """
+    Labels every group of `color` in one vectorized pass. Returns (labels, n_groups,
+    liberty_counts): `labels` is an N x N int array with 0 for points not of `color`
+    and 1..n_groups for each group (numbered in row-major order of their first stone),
+    and liberty_counts[k] is the number of distinct liberties of group k.
+    """
+    n = board.shape[0]
+    labels, n_groups = label(board == color, structure=FOUR_CONNECTED)
+    # For each of the four directions, pair every empty point with the label of the
+    # group next to it, packed as label * N*N + point; unique pairs are liberties.
+    padded = np.pad(labels, 1)
+    empty = board == EMPTY
+    points = np.arange(n * n, dtype=np.int64).reshape(n, n)
+    pairs = []
+    for dr, dc in D4:
+        neighbor = padded[1 + dr:1 + dr + n, 1 + dc:1 + dc + n]
+        touching = empty & (neighbor > 0)
+        pairs.append(neighbor[touching].astype(np.int64) * (n * n) + points[touching])
+    liberty_pairs = np.unique(np.concatenate(pairs))
+    liberty_counts = np.bincount(liberty_pairs // (n * n), minlength=n_groups + 1)
+    return labels, n_groups, liberty_counts
+
+
+@functools.lru_cache(maxsize=None)
+def neighbor_table(n):
+    """
+    Precomputes the on-board orthogonal neighbors of every point of an N x N board:
+    neigh4[r][c] is a tuple of (nr, nc).
+    """
+    return [[tuple((r + dr, c + dc) for dr, dc in D4 if 0 <= r + dr < n and 0 <= c + dc < n)
+             for c in range(n)] for r in range(n)]
+
+
+@functools.lru_cache(maxsize=None)
+def pattern_mask_table(n):
+    """
+    Precomputes, for every pattern in SHAPE_PATTERNS and every point of an N x N board,
+    the bitboard of the points the pattern covers from there (see board_to_bitboard).
+    The mask is 0 where any of those points is off the board, so edge and corner cells
+    reject a pattern with a single lookup. Returns {pattern: mask[r][c]}.
+    """
+    table = {}
+    for pattern in SHAPE_PATTERNS:
+        masks = [[0] * n for _ in range(n)]
+        for r in range(n):
+            for c in range(n):
+                if all(0 <= r + dr < n and 0 <= c + dc < n for dr, dc in pattern):
+                    masks[r][c] = sum(1 << ((r + dr) * n + c + dc) for dr, dc in pattern)
+        table[pattern] = masks
+    return table
+
+
+def board_to_bitboard(board, color):
+    """
+    Packs the points of `color` into a bitboard: a Python int whose bit r * N + c is set
+    when (r, c) holds that color. Python ints are arbitrary precision, so a whole 19x19
+    board fits in one value and a pattern test is a single AND over all 361 bits.
+    """
+    bits = np.packbits((board == color).ravel(), bitorder='little')
+    return int.from_bytes(bits.tobytes(), 'little')
+
+
 class GoGameAnalyzer:
     """
     Analyzes a Go game from an SGF file, providing information about groups,
     liberties, and the nature of specific moves.
     """
 
-    def __init__(self, sgf_content):
+    def __init__(self, sgf_content, keep_history=False):
         """
         Initializes the analyzer with the content of an SGF file.
 
@@ -18,20 +117,34 @@ class GoGameAnalyzer:
 
         Args:
             sgf_content (bytes): The raw byte content of the SGF file.
+            keep_history (bool): Record every move played in self.history.
+                Only the last move is needed for analysis, so this is off
+                by default and self.history is None.
         """
         try:
             self.game = sgf.Sgf_game.from_bytes(sgf_content)
             self.board_size = self.game.get_size()
             self.board = self._initialize_board()
+            self._neigh4 = neighbor_table(self.board_size)
+            # Flat-index (r * N + c) neighbors, for the group records below
+            self._adjacent = [tuple(nr * self.board_size + nc for nr, nc in self._neigh4[r][c])
+                              for r in range(self.board_size) for c in range(self.board_size)]
+            self._cells = self.board.reshape(-1)  # Flat view of self.board
             self._place_setup_stones() # Correctly place handicap stones
-            self.history = []
+            self._init_groups()
+            # Bitboard mirror of self.board for the shape-pattern tests
+            self.bitboards = {color: board_to_bitboard(self.board, color) for color in (BLACK, WHITE)}
+            self._pattern_masks = pattern_mask_table(self.board_size)
+            self.last_move = None
+            self.last_color = None
+            self.history = [] if keep_history else None
             self.ko_point = None # Simple ko check
         except ValueError as e:
             raise ValueError(f"Error parsing SGF file: {e}")
 
     def _initialize_board(self):
         """Creates an empty board."""
-        return [['.' for _ in range(self.board_size)] for _ in range(self.board_size)]
+        return np.zeros((self.board_size, self.board_size), dtype=np.uint8)
 
     def _place_setup_stones(self):
         """
@@ -44,12 +157,12 @@ class GoGameAnalyzer:
             for r, c in root_node.get('AB'):
                 if 0 <= r < self.board_size and 0 <= c < self.board_size:
                     flipped_r = (self.board_size - 1) - r
-                    self.board[flipped_r][c] = 'b'
+                    self.board[flipped_r, c] = BLACK
         if 'AW' in root_node.properties():
             for r, c in root_node.get('AW'):
                 if 0 <= r < self.board_size and 0 <= c < self.board_size:
                     flipped_r = (self.board_size - 1) - r
-                    self.board[flipped_r][c] = 'w'
+                    self.board[flipped_r, c] = WHITE
 
     def get_next_player(self):
         """
@@ -64,101 +177,148 @@ class GoGameAnalyzer:
             pl_property = root_node.get('PL')
             return pl_property.lower()
 
-        # If 'PL' is not present, fall back to inferring from history.
-        if not self.history:
+        # If 'PL' is not present, fall back to inferring from the last move.
+        if self.last_color is None:
             # No moves played, and no PL property. Default to Black.
             return 'b'
         else:
-            # Infer from the last move played.
-            last_color = self.history[-1][1]
-            return 'w' if last_color == 'b' else 'b'
+            return 'w' if self.last_color == 'b' else 'b'
 
     def draw_board(self, move_to_show=None):
         """
         Prints a text representation of the current board state.
         """
-        if not self.board:
+        if self.board is None:
             print("Board is not initialized.")
             return
 
-        col_letters = "ABCDEFGHJKLMNOPQRSTUVWXYZ"
-        col_map = col_letters[:self.board_size]
+        col_map = KATAGO_COLUMNS[:self.board_size]
+        cells = STONE_CHAR[self.board]  # One lookup for the whole board
+        if move_to_show and all(0 <= i < self.board_size for i in move_to_show):
+            cells[move_to_show] = 'S' # Mark the move being analyzed
 
         print(f"\n   {' '.join(col_map)}")
         for r in range(self.board_size):
             row_label = self.board_size - r
-            row_cells = []
-            for c in range(self.board_size):
-                if move_to_show and (r, c) == move_to_show:
-                    row_cells.append('S') # Mark the move being analyzed
-                else:
-                    stone = self.board[r][c]
-                    row_cells.append(stone.replace('b', 'X').replace('w', 'O'))
-
-            row_str = ' '.join(row_cells)
+            row_str = ' '.join(cells[r])
             print(f"{row_label:02d} {row_str}")
         print("")
 
-    def _get_neighbors(self, r, c, diagonals=False):
-        """Returns valid neighbors for a given coordinate."""
-        deltas = [(0, 1), (0, -1), (1, 0), (-1, 0)]
-        if diagonals:
-            deltas.extend([(1, 1), (1, -1), (-1, 1), (-1, -1)])
-
-        neighbors = []
-        for dr, dc in deltas:
-            nr, nc = r + dr, c + dc
-            if 0 <= nr < self.board_size and 0 <= nc < self.board_size:
-                neighbors.append((nr, nc))
-        return neighbors
-
-    def _find_group(self, r, c, color, visited):
-        """Finds a group of stones and its liberties using BFS."""
-        if (r, c) in visited or self.board[r][c] != color:
-            return None, None
-
-        group = set()
-        liberties = set()
-        q = collections.deque([(r, c)])
-        visited.add((r, c))
-        group.add((r, c))
-
-        while q:
-            curr_r, curr_c = q.popleft()
-            for nr, nc in self._get_neighbors(curr_r, curr_c):
-                if self.board[nr][nc] == '.':
-                    liberties.add((nr, nc))
-                elif self.board[nr][nc] == color and (nr, nc) not in visited:
-                    visited.add((nr, nc))
-                    group.add((nr, nc))
-                    q.append((nr, nc))
-        return group, liberties
+    # --- Group Records ---
+    # Every group is kept as a union-find tree over flat point indices. The root of each
+    # tree owns the group's member list and liberty set, so play_move updates only the
+    # groups around the move and analyze_move answers from them without a flood fill.
+
+    def _init_groups(self):
+        """Builds the group records for the stones already on the board (setup stones)."""
+        points = self.board_size * self.board_size
+        self._parent = list(range(points))
+        self._rank = [0] * points
+        self._members = {}    # root -> flat indices of the group's stones
+        self._liberties = {}  # root -> flat indices of the group's liberties
+        if not self.board.any():
+            return  # No setup stones
+        for color in (BLACK, WHITE):
+            flat_labels = label_groups(self.board, color)[0].reshape(-1)
+            roots = {}  # label -> the group's first stone, which becomes its root
+            for p in np.flatnonzero(flat_labels).tolist():
+                root = roots.setdefault(int(flat_labels[p]), p)
+                self._parent[p] = root
+                if root != p:
+                    self._rank[root] = 1
+                self._members.setdefault(root, []).append(p)
+                self._liberties.setdefault(root, set()).update(
+                    q for q in self._adjacent[p] if self._cells[q] == EMPTY)
+
+    def _find(self, p):
+        """Returns the root of the group containing the stone at flat index p."""
+        parent = self._parent
+        while parent[p] != p:
+            parent[p] = parent[parent[p]]  # Path halving
+            p = parent[p]
+        return p
+
+    def _union(self, a, b):
+        """Merges the groups with roots a and b; returns the root of the merged group."""
+        if a == b:
+            return a
+        if self._rank[a] < self._rank[b]:
+            a, b = b, a
+        self._parent[b] = a
+        if self._rank[a] == self._rank[b]:
+            self._rank[a] += 1
+        self._members[a].extend(self._members.pop(b))
+        self._liberties[a] |= self._liberties.pop(b)
+        return a
+
+    def _add_stone(self, p, color):
+        """
+        Records a stone of `color` just placed at flat index p: merges it with friendly
+        neighbors, takes p away from neighboring groups' liberties and removes opponent
+        groups left without any. Returns the captured stones' flat indices.
+        """
+        self._parent[p], self._rank[p] = p, 0
+        self._members[p] = [p]
+        self._liberties[p] = {q for q in self._adjacent[p] if self._cells[q] == EMPTY}
+        root, captured = p, []
+        for q in self._adjacent[p]:
+            if self._cells[q] == EMPTY:
+                continue
+            neighbor_root = self._find(q)
+            self._liberties[neighbor_root].discard(p)
+            if self._cells[q] == color:
+                root = self._union(root, neighbor_root)
+            elif not self._liberties[neighbor_root]:
+                captured.extend(self._remove_group(neighbor_root))
+        return captured
+
+    def _remove_group(self, root):
+        """Takes a captured group off the board; its points become liberties of the groups around them."""
+        stones = self._members.pop(root)
+        del self._liberties[root]
+        for p in stones:
+            self._cells[p] = EMPTY
+            self._parent[p], self._rank[p] = p, 0
+        for p in stones:
+            for q in self._adjacent[p]:
+                if self._cells[q] != EMPTY:
+                    self._liberties[self._find(q)].add(p)
+        return stones
 
     def get_groups_and_liberties(self):
         """Calculates all groups on the board and their liberties."""
-        visited = set()
         groups = {'black': [], 'white': []}
-        for r in range(self.board_size):
-            for c in range(self.board_size):
-                if self.board[r][c] != '.' and (r, c) not in visited:
-                    color_char = self.board[r][c]
-                    color_name = 'black' if color_char == 'b' else 'white'
-                    group, liberties = self._find_group(r, c, color_char, visited)
-                    if group:
-                        groups[color_name].append((group, len(liberties)))
+        for color, color_name in ((BLACK, 'black'), (WHITE, 'white')):
+            labels, n_groups, liberty_counts = label_groups(self.board, color)
+            if not n_groups:
+                continue
+            # Bucket the stones by label: sort the stone indices by their group.
+            flat_labels = labels.ravel()
+            stones = np.flatnonzero(flat_labels)
+            stones = stones[np.argsort(flat_labels[stones], kind='stable')]
+            sizes = np.bincount(flat_labels[stones], minlength=n_groups + 1)[1:]
+            for k, members in enumerate(np.split(stones, np.cumsum(sizes)[:-1]), 1):
+                group = {divmod(i, self.board_size) for i in members.tolist()}
+                groups[color_name].append((group, int(liberty_counts[k])))
         return groups
 
     def play_move(self, r, c, color):
         """Places a stone on the board and updates the state."""
         if not (0 <= r < self.board_size and 0 <= c < self.board_size):
             raise ValueError("Move is outside the board.")
-        if self.board[r][c] != '.':
+        if self.board[r, c] != EMPTY:
             raise ValueError(f"Intersection ({r},{c}) is already occupied.")
         if (r, c) == self.ko_point:
             raise ValueError(f"Illegal ko capture at ({r},{c}).")
 
-        self.board[r][c] = color
-        captured_stones = self._handle_captures(r, c, color)
+        n = self.board_size
+        self.board[r, c] = COLOR_VALUE[color]
+        captured_stones = [divmod(p, n) for p in self._add_stone(r * n + c, COLOR_VALUE[color])]
+
+        # Keep the bitboards in step with the board
+        self.bitboards[COLOR_VALUE[color]] |= 1 << (r * self.board_size + c)
+        for cr, cc in captured_stones:
+            self.bitboards[OPPONENT[COLOR_VALUE[color]]] &= ~(1 << (cr * self.board_size + cc))
 
         if len(captured_stones) == 1:
             # This is a simplification. A proper ko check requires checking
@@ -167,90 +327,65 @@ class GoGameAnalyzer:
         else:
             self.ko_point = None
 
-        self.history.append(((r, c), color))
-
-    def _handle_captures(self, r, c, color):
-        """Checks for and removes captured groups."""
-        opponent_color = 'w' if color == 'b' else 'b'
-        captured_stones = []
-        for nr, nc in self._get_neighbors(r, c):
-            if self.board[nr][nc] == opponent_color:
-                group, liberties = self._find_group(nr, nc, opponent_color, set())
-                if group and not liberties:
-                    for gr, gc in group:
-                        self.board[gr][gc] = '.'
-                    captured_stones.extend(list(group))
-        return captured_stones
+        self.last_move, self.last_color = (r, c), color
+        if self.history is not None:
+            self.history.append(((r, c), color))
 
     # --- Move Analysis Helpers ---
 
     def _check_pattern(self, r, c, color, patterns):
-        """Generic helper to check for friendly stones at all relative positions."""
-        for dr, dc in patterns:
-            pr, pc = r + dr, c + dc
-            # Check if the coordinate is within the board boundaries
-            if not (0 <= pr < self.board_size and 0 <= pc < self.board_size):
-                return False  # Part of the pattern is off-board
-            # If any stone is NOT present, the pattern is not complete
-            if self.board[pr][pc] != color:
-                return False
-        # If the loop completes without returning, all stones were found
-        return True
+        """Generic helper to check for friendly stones at all relative positions (one of SHAPE_PATTERNS)."""
+        mask = self._pattern_masks[patterns][r][c]  # 0 where the pattern runs off the board
+        # The pattern is complete when every masked point holds a `color` stone
+        return mask != 0 and self.bitboards[color] & mask == mask
 
     def _is_peep(self, r, c, color):
         """A peep is a move that threatens to cut an opponent's shape."""
-        opponent_color = 'w' if color == 'b' else 'b'
         # Check for a peep at the cutting point of a one-point jump.
-        if (self._check_pattern(r-1, c, opponent_color, [(0,0)]) and self._check_pattern(r+1, c, opponent_color, [(0,0)])) or \
-           (self._check_pattern(r, c-1, opponent_color, [(0,0)]) and self._check_pattern(r, c+1, opponent_color, [(0,0)])):
-            return True
-        return False
+        return any(self._check_pattern(r, c, OPPONENT[color], p) for p in PEEP_PATTERNS)
 
     def _completes_bamboo_joint(self, r, c, color):
         """Checks if a move completes a Bamboo Joint (Takefu), a very strong connection."""
-        # A bamboo joint is formed by two parallel one-point jumps. This move is the 4th stone.
-        # Check horizontal joint to the left
-        if self._check_pattern(r,c,color,[(0,-2), (1,0), (1,-2)]) or self._check_pattern(r,c,color,[(0,-2), (-1,0), (-1,-2)]): return True
-        # Check horizontal joint to the right
-        if self._check_pattern(r,c,color,[(0,2), (1,0), (1,2)]) or self._check_pattern(r,c,color,[(0,2), (-1,0), (-1,2)]): return True
-        # Check vertical joint above
-        if self._check_pattern(r,c,color,[(-2,0), (0,1), (-2,1)]) or self._check_pattern(r,c,color,[(-2,0), (0,-1), (-2,-1)]): return True
-        # Check vertical joint below
-        if self._check_pattern(r,c,color,[(2,0), (0,1), (2,1)]) or self._check_pattern(r,c,color,[(2,0), (0,-1), (2,-1)]): return True
-        return False
+        return any(self._check_pattern(r, c, color, p) for p in BAMBOO_JOINT_PATTERNS)
 
     def _completes_empty_triangle(self, r, c, color):
         """Checks if a move completes an Empty Triangle, a classic "bad shape"."""
-        if self._check_pattern(r, c, color, [(0, -1), (-1, 0)]): return True
-        if self._check_pattern(r, c, color, [(-1, 0), (0, 1)]): return True
-        if self._check_pattern(r, c, color, [(0, 1), (1, 0)]): return True
-        if self._check_pattern(r, c, color, [(1, 0), (0, -1)]): return True
-        return False
+        return any(self._check_pattern(r, c, color, p) for p in EMPTY_TRIANGLE_PATTERNS)
 
     def _completes_tiger_mouth(self, r, c, color):
         """Checks if a move completes a Tiger Mouth, a "good shape"."""
-        if self._check_pattern(r, c, color, [(-1, -1), (1, -1)]): return True
-        if self._check_pattern(r, c, color, [(-1, 1), (1, 1)]): return True
-        if self._check_pattern(r, c, color, [(1, -1), (1, 1)]): return True
-        if self._check_pattern(r, c, color, [(-1, -1), (-1, 1)]): return True
-        return False
+        return any(self._check_pattern(r, c, color, p) for p in TIGER_MOUTH_PATTERNS)
 
     def analyze_move(self, r, c, color):
         """Analyzes a given move for its properties."""
         if not (0 <= r < self.board_size and 0 <= c < self.board_size): return {"error": "Move is outside the board."}
-        if self.board[r][c] != '.': return {"error": "Intersection is already occupied."}
+        if self.board[r, c] != EMPTY: return {"error": "Intersection is already occupied."}
         if (r, c) == self.ko_point: return {"error": "Illegal ko capture."}
-
-        # --- Simulate the move on a temporary board ---
-        temp_board = [row[:] for row in self.board]
-        temp_board[r][c] = color
-        temp_analyzer = GoGameAnalyzer.__new__(GoGameAnalyzer)
-        temp_analyzer.board = temp_board
-        temp_analyzer.board_size = self.board_size
-
-        captured_stones = temp_analyzer._handle_captures(r, c, color)
-        own_group, own_liberties_set = temp_analyzer._find_group(r, c, color, set())
-        own_liberties = len(own_liberties_set) if own_liberties_set else 0
+        color = COLOR_VALUE[color]
+
+        # --- Work out the move's effect from the neighboring groups' records ---
+        p = r * self.board_size + c
+        opponent_color = OPPONENT[color]
+        neighbors = self._neigh4[r][c]
+        friendly_roots, opponent_roots = set(), set()
+        own_liberties = set()
+        for q in self._adjacent[p]:
+            if self._cells[q] == color: friendly_roots.add(self._find(q))
+            elif self._cells[q] == opponent_color: opponent_roots.add(self._find(q))
+            else: own_liberties.add(q)
+        for root in friendly_roots:
+            own_liberties |= self._liberties[root]
+        own_liberties.discard(p)
+
+        # Opponent groups whose only liberty (if any) is (r, c) are captured; their points
+        # become liberties of the new group where they touch it.
+        captured_roots = [root for root in opponent_roots if self._liberties[root] <= {p}]
+        captured_stones = [divmod(s, self.board_size) for root in captured_roots for s in self._members[root]]
+        for root in captured_roots:
+            for s in self._members[root]:
+                if any(q == p or (self._cells[q] == color and self._find(q) in friendly_roots) for q in self._adjacent[s]):
+                    own_liberties.add(s)
+        own_liberties = len(own_liberties)
 
         # --- Basic Tactical Analysis ---
         analysis = {
@@ -262,40 +397,34 @@ class GoGameAnalyzer:
         if analysis["suicide"]: return analysis
         analysis["self_atari"] = own_liberties == 1 and not captured_stones
 
-        opponent_color = 'w' if color == 'b' else 'b'
-        for nr, nc in self._get_neighbors(r, c):
-            if temp_analyzer.board[nr][nc] == opponent_color:
-                _, liberties = temp_analyzer._find_group(nr, nc, opponent_color, set())
-                if liberties and len(liberties) == 1: analysis["atari"] = True
-
-        friendly_groups, opponent_groups = set(), set()
-        for nr, nc in self._get_neighbors(r,c):
-            if self.board[nr][nc] == color: friendly_groups.add(frozenset(self._find_group(nr, nc, color, set())[0]))
-            elif self.board[nr][nc] == opponent_color: opponent_groups.add(frozenset(self._find_group(nr, nc, opponent_color, set())[0]))
+        # Capturing never gives liberties to the opponent's other groups
+        for root in opponent_roots:
+            if root not in captured_roots and len(self._liberties[root] - {p}) == 1: analysis["atari"] = True
 
-        if len(friendly_groups) > 1: analysis["connects"] = True
-        if len(opponent_groups) > 1: analysis["cuts"] = True
+        # Each group has one root, so distinct roots around (r, c) are distinct groups
+        if len(friendly_roots) > 1: analysis["connects"] = True
+        if len(opponent_roots) > 1: analysis["cuts"] = True
 
         # --- Shape and Pattern Analysis ---
         analysis["peep"] = self._is_peep(r, c, color)
         analysis["completes_empty_triangle"] = self._completes_empty_triangle(r, c, color)
         analysis["completes_tiger_mouth"] = self._completes_tiger_mouth(r, c, color)
         analysis["completes_bamboo_joint"] = self._completes_bamboo_joint(r, c, color)
-        analysis["one_point_jump"] = self._check_pattern(r, c, color, [(-2,0), (2,0), (0,-2), (0,2)]) and \
-                                      not self._check_pattern(r,c, color, [(-1,0), (1,0), (0,-1), (0,1)])
-        analysis["knights_move"] = self._check_pattern(r, c, color, [(1,2), (1,-2), (-1,2), (-1,-2), (2,1), (2,-1), (-2,1), (-2,-1)])
-        analysis["diagonal"] = self._check_pattern(r, c, color, [(1,1), (1,-1), (-1,1), (-1,-1)])
+        analysis["one_point_jump"] = self._check_pattern(r, c, color, ONE_POINT_JUMP_PATTERN) and \
+                                      not self._check_pattern(r, c, color, ADJACENT_PATTERN)
+        analysis["knights_move"] = self._check_pattern(r, c, color, KNIGHTS_MOVE_PATTERN)
+        analysis["diagonal"] = self._check_pattern(r, c, color, DIAGONAL_PATTERN)
 
         # --- Contextual and Strategic Analysis ---
-        analysis["throw_in"] = analysis["self_atari"] and len(self._get_neighbors(r,c)) == len([n for n in self._get_neighbors(r,c) if self.board[n[0]][n[1]]==opponent_color])
+        analysis["throw_in"] = analysis["self_atari"] and len(neighbors) == len([n for n in neighbors if self.board[n]==opponent_color])
 
-        if len(captured_stones) == 1 and len(own_group) == 1 and own_liberties == 1:
-             if own_liberties_set and own_liberties_set.pop() == captured_stones[0]: analysis["starts_ko"] = True
+        # A lone stone that captured one stone is left with that point as its only
+        # liberty when it has a single liberty at all.
+        if len(captured_stones) == 1 and not friendly_roots and own_liberties == 1: analysis["starts_ko"] = True
 
-        if self.history:
-            last_move, _ = self.history[-1]
+        if self.last_move:
             # A simple heuristic for tenuki (playing in a different area of the board)
-            if (r - last_move[0])**2 + (c - last_move[1])**2 > 50: analysis["tenuki"] = True
+            if (r - self.last_move[0])**2 + (c - self.last_move[1])**2 > 50: analysis["tenuki"] = True
 
         return analysis
 
@@ -322,10 +451,9 @@ def parse_move_string(move_str, board_size):
     move_str = move_str.lower().strip()
     if not (2 <= len(move_str) <= 3): raise ValueError("Invalid move format.")
     col_char, row_str = move_str[0], move_str[1:]
-    # Remove 'i' from the alphabet for Go coordinates
-    col_letters = "abcdefghjklmnopqrstuvwxyz"
-    if col_char not in col_letters[:board_size]: raise ValueError(f"Invalid column: {col_char}")
-    col = col_letters.index(col_char)
+    # Go coordinates skip 'i'; COL_INDEX has no entry for it
+    col = COL_INDEX.get(col_char)
+    if col is None or col >= board_size: raise ValueError(f"Invalid column: {col_char}")
     if not row_str.isdigit(): raise ValueError(f"Invalid row: {row_str}")
     # Convert from Go coordinate (e.g., 19) to 0-indexed array row
     row = board_size - int(row_str)
@@ -1,23 +1,39 @@
-import json
+import sys
+import heapq
 import argparse
 
-def parse_katago_analysis(filename):
+# You must install orjson: pip install orjson
+try:
+    import orjson
+except ImportError:
+    print("Error: The 'orjson' library is required. Please install it using 'pip install orjson'")
+    sys.exit(1)
+
+# katapyllm's log opens each JSON block with this header and closes it with a line of dashes
+BLOCK_HEADER = b"--- KATA GO ANALYSIS JSON ---"
+END_MARKER = b"\n---"
+
+def parse_katago_analysis(filename, top_k=None):
     """
     Parses a Katago analysis JSON file, sorts all moves by playSelectionValue and then by visits,
-    and returns the fully ranked list.
+    and returns the fully ranked list, or only its first `top_k` moves if given.
     """
     try:
-        with open(filename, 'r') as f:
+        with open(filename, 'rb') as f:
             content = f.read()
-            # Find the start of the JSON object to handle files with leading text
-            json_start_index = content.find('{')
-            if json_start_index == -1:
-                print("Error: No JSON object found in the file.")
-                return []
-            
-            # Slice the string to get only the JSON part
-            json_content = content[json_start_index:]
-            data = json.loads(json_content)
+        # Logs of a whole game hold one block per position, the full game's last; use that one
+        block_start_index = max(content.rfind(BLOCK_HEADER), 0)
+        # Find the start of the JSON object to handle files with leading text
+        json_start_index = content.find(b'{', block_start_index)
+        if json_start_index == -1:
+            print("Error: No JSON object found in the file.")
+            return []
+
+        # Stop at the end of the block, before any log lines that follow it
+        json_end_index = content.find(END_MARKER, json_start_index)
+        if json_end_index == -1:
+            json_end_index = len(content)
+        data = orjson.loads(content[json_start_index:json_end_index])
 
         # [cite_start]The moves are in the 'moveInfos' key [cite: 1]
         if 'moveInfos' not in data or not data['moveInfos']:
@@ -28,18 +44,16 @@ def parse_katago_analysis(filename):
 
         # Sort by playSelectionValue (desc) and then by visits (desc)
         # Using .get() with a default value adds robustness for entries that might be missing a key
-        sorted_moves = sorted(
-            move_infos, 
-            key=lambda x: (x.get('playSelectionValue', 0), x.get('visits', 0)), 
-            reverse=True
-        )
-
-        return sorted_moves
+        rank_key = lambda x: (x.get('playSelectionValue', 0), x.get('visits', 0))
+        if top_k is not None:
+            # Only the best few are wanted: a heap of size top_k instead of a full sort
+            return heapq.nlargest(top_k, move_infos, key=rank_key)
+        return sorted(move_infos, key=rank_key, reverse=True)
 
     except FileNotFoundError:
         print(f"Error: File not found: {filename}")
         return []
-    except json.JSONDecodeError:
+    except orjson.JSONDecodeError:
         print(f"Error: Invalid JSON format in file: {filename}")
         return []
     except KeyError as e:
@@ -53,9 +67,10 @@ def parse_katago_analysis(filename):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Parse a Katago analysis JSON file and return a ranked list of all moves.")
     parser.add_argument("filename", help="Path to the Katago analysis file.")
+    parser.add_argument("--top", type=int, default=None, help="Only show this many of the best moves.")
     args = parser.parse_args()
 
-    ranked_moves = parse_katago_analysis(args.filename)
+    ranked_moves = parse_katago_analysis(args.filename, top_k=args.top)
 
     if ranked_moves:
         print("Ranked Moves (sorted by playSelectionValue and visits):")